@@ -1,11 +1,18 @@
 import abc
 import argparse
 import asyncio
+import bisect
+import copy
+import fcntl
+import hashlib
 import json
 import logging
+import os
 import pathlib
 import signal
 import socket
+import struct
+import time
 import uinput
 import uuid
 import websockets
@@ -25,11 +32,8 @@ def setup_logging(level: str = 'INFO'):
 
 
 class KeyCodes:
-    NAME_TO_EVENT: dict[str, tuple[int, int]] = {
-        name: getattr(uinput.ev, name)
-        for name in dir(uinput.ev)
-        if name.isupper() and not name.startswith('_')
-    }
+    # built lazily on first lookup to keep startup fast
+    NAME_TO_EVENT: dict[str, tuple[int, int]] | None = None
 
     EVENT_SETS = {
         'CONTROLLER_BUTTONS': frozenset([
@@ -60,6 +64,12 @@ class KeyCodes:
 
     @classmethod
     def get_event_by_name(cls, name: str):
+        if cls.NAME_TO_EVENT is None:
+            cls.NAME_TO_EVENT = {
+                name: getattr(uinput.ev, name)
+                for name in dir(uinput.ev)
+                if name.isupper() and not name.startswith('_')
+            }
         return cls.NAME_TO_EVENT[name]
 
     @classmethod
@@ -67,6 +77,78 @@ class KeyCodes:
         return cls.EVENT_SETS[name]
 
 
+class SettingsLoader:
+    '''Loads the YAML settings file and caches the parsed result until its content changes.'''
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.file_stat: tuple[int, int] | None = None  # (mtime_ns, size)
+        self.content_hash: str | None = None
+        self.config: dict[str, dict] = {}
+
+    def has_changed(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return self.file_stat is not None
+        return (stat.st_mtime_ns, stat.st_size) != self.file_stat
+
+    def load(self) -> tuple[dict[str, dict], bool]:
+        '''Return the parsed settings and whether they changed since the last call.'''
+        try:
+            stat = self.path.stat()
+            content = self.path.read_bytes()
+        except FileNotFoundError:
+            changed = self.file_stat is not None or self.content_hash is None
+            self.file_stat = None
+            self.content_hash = ''
+            self.config = {}
+            return self.config, changed
+
+        self.file_stat = (stat.st_mtime_ns, stat.st_size)
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == self.content_hash:
+            return self.config, False
+
+        # use the libyaml based loader if available, it is considerably faster
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        self.config = yaml.load(content, Loader=loader) or {}
+        self.content_hash = content_hash
+        return self.config, True
+
+    @staticmethod
+    def parse_keybind_preset_library(config: dict[str, dict]) -> dict[str, list[tuple[str, str]]]:
+        keybind_preset_library: dict[str, list[list]] = config.get('keybind_preset_library', {})
+        return {
+            preset_name: [(key, event) for key, event in keybinds] for preset_name, keybinds in keybind_preset_library.items()
+        }
+
+
+class LatencyHistogram:
+    '''Fixed bucket latency histogram in milliseconds.'''
+
+    BOUNDS: tuple[float, ...] = (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value_ms: float):
+        index = bisect.bisect_left(self.BOUNDS, value_ms)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value_ms
+
+    def serialize(self):
+        return {
+            'bounds': list(self.BOUNDS),
+            'counts': self.counts,
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
 class VirtualDevice(abc.ABC):
     def __init__(
         self,
@@ -81,14 +163,50 @@ class VirtualDevice(abc.ABC):
         self.allowed_events: set[str] = set(allowed_events)
         self.keybind_presets: dict[str, list[tuple[str, str]]] = keybind_presets
         self.is_connected: bool = False
+        # settings change ('updated' or 'recreated') that happened while the registration was in flight
+        self.pending_update: str | None = None
+
+        # bitmap of pressed keys to suppress redundant key events
+        tracked_events = sorted(event for event in self.allowed_events if event.startswith(('BTN_', 'KEY_')))
+        self.key_bits: dict[str, int] = {event: 1 << index for index, event in enumerate(tracked_events)}
+        self.pressed_keys: int = 0
+
+        # entry name and parameters in the settings file, used to apply settings changes
+        self.settings_name: str | None = None
+        self.settings: dict[str, int | str | list] = {}
 
     @abc.abstractmethod
     def emit(self, event_name: str, value: int | float):
         ...
 
+    def close(self):
+        '''Release the underlying virtual device.'''
+
+    def flush(self):
+        '''Write pending events right away, for backends that batch their writes.'''
+
     def is_event_allowed(self, event_name: str):
         return event_name in self.allowed_events
 
+    def update_key_state(self, event_name: str, value: int | float):
+        '''Update the pressed keys and return False if the event would not change the key state.'''
+        bit = self.key_bits.get(event_name)
+        if bit is None:
+            return True
+
+        pressed = bool(self.pressed_keys & bit)
+        if bool(value) == pressed:
+            return False
+
+        self.pressed_keys ^= bit
+        return True
+
+    def release_all_keys(self):
+        for event_name, bit in self.key_bits.items():
+            if self.pressed_keys & bit:
+                self.emit(event_name, 0)
+        self.pressed_keys = 0
+
 
 class UInputDevice(VirtualDevice):
     '''Handles sending virtual gamepad events via uinput.'''
@@ -135,6 +253,138 @@ class UInputDevice(VirtualDevice):
         except Exception:
             logger.exception(f'Failed to emit event {event} -> {value} on {self.name}')
 
+    def close(self):
+        self.device.destroy()
+
+
+class RawUInputDevice(VirtualDevice):
+    '''
+    Writes input_event structs directly to the uinput file descriptor without python-uinput.
+
+    All events emitted in the same event loop iteration are written with a single writev call.
+    When output_file is set, the device setup is skipped and only the events are written to this
+    regular file or pipe instead, e.g. for benchmarks without uinput access.
+    '''
+
+    EV_SYN = 0x00
+    EV_KEY = 0x01
+    EV_REL = 0x02
+    SYN_REPORT = 0
+
+    UI_DEV_CREATE = 0x5501
+    UI_DEV_DESTROY = 0x5502
+    UI_SET_EVBIT = 0x40045564
+    UI_SET_KEYBIT = 0x40045565
+    UI_SET_RELBIT = 0x40045566
+
+    # struct input_event (timeval, type, code, value) and legacy struct uinput_user_dev
+    INPUT_EVENT = struct.Struct('llHHi')
+    UINPUT_USER_DEV = struct.Struct('80sHHHHi256i')
+
+    def __init__(
+        self,
+        name: str = 'Raw UInput Device',
+        group_id: str | None = None,
+        allowed_events: set[str] = None,
+        keybind_presets: dict[str, list[tuple[str, str]]] = None,
+        uinput_name: str = 'UInput Device',
+        bustype: int = 0,
+        vendor: int = 0,
+        product: int = 0,
+        version: int = 0,
+        device_path: str = '/dev/uinput',
+        output_file: str | None = None,
+    ):
+        if allowed_events is None:
+            allowed_events = KeyCodes.get_event_set_by_name('DPAD_CONTROLLER_BUTTONS')
+
+        if keybind_presets is None:
+            keybind_presets = {}
+
+        super().__init__(name, group_id, allowed_events, keybind_presets)
+
+        self.pending_events: list[bytes] = []
+        self.flush_handle: asyncio.Handle | None = None
+
+        self.is_uinput = output_file is None
+        if self.is_uinput:
+            # never create the device path, e.g. /dev/uinput without the uinput module loaded
+            if not pathlib.Path(device_path).is_char_device():
+                raise OSError(f'{device_path} is not a character device, is the uinput module loaded?')
+            self.fd = os.open(device_path, os.O_WRONLY | os.O_NONBLOCK)
+            try:
+                self.setup(uinput_name, bustype, vendor, product, version)
+            except Exception:
+                os.close(self.fd)
+                raise
+        elif pathlib.Path(output_file).is_fifo():
+            # blocks until a reader opened the pipe
+            self.fd = os.open(output_file, os.O_WRONLY)
+        else:
+            self.fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def setup(self, uinput_name: str, bustype: int, vendor: int, product: int, version: int):
+        for event in self.allowed_events:
+            event_type, code = KeyCodes.get_event_by_name(event)
+            if event_type == self.EV_KEY:
+                fcntl.ioctl(self.fd, self.UI_SET_EVBIT, self.EV_KEY)
+                fcntl.ioctl(self.fd, self.UI_SET_KEYBIT, code)
+            elif event_type == self.EV_REL:
+                fcntl.ioctl(self.fd, self.UI_SET_EVBIT, self.EV_REL)
+                fcntl.ioctl(self.fd, self.UI_SET_RELBIT, code)
+            else:
+                raise ValueError(f'Event {event} is not supported by the raw uinput device')
+
+        os.write(self.fd, self.UINPUT_USER_DEV.pack(
+            uinput_name.encode()[:79], bustype, vendor, product, version, 0, *([0] * 256),
+        ))
+        fcntl.ioctl(self.fd, self.UI_DEV_CREATE)
+
+    def pack_event(self, event_type: int, code: int, value: int):
+        timestamp = time.time()
+        seconds = int(timestamp)
+        return self.INPUT_EVENT.pack(seconds, int((timestamp - seconds) * 1_000_000), event_type, code, value)
+
+    def emit(self, event: str, value: int):
+        if not self.is_event_allowed(event):
+            return
+
+        try:
+            event_type, code = KeyCodes.get_event_by_name(event)
+        except KeyError:
+            logger.warning(f'Unknown key event: {event}')
+            return
+
+        self.pending_events.append(self.pack_event(event_type, code, int(value)))
+
+        if self.flush_handle is None:
+            try:
+                self.flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+            except RuntimeError:
+                # no event loop to batch events in, write directly
+                self.flush()
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending_events:
+            return
+
+        self.pending_events.append(self.pack_event(self.EV_SYN, self.SYN_REPORT, 0))
+        events, self.pending_events = self.pending_events, []
+        try:
+            os.writev(self.fd, events)
+            logger.debug('Wrote %d events on device %s (%s)', len(events), self.name, self.id)
+        except OSError:
+            logger.exception(f'Failed to write {len(events)} events on {self.name}')
+
+    def close(self):
+        self.flush()
+        if self.is_uinput:
+            fcntl.ioctl(self.fd, self.UI_DEV_DESTROY)
+        os.close(self.fd)
+
 
 class VirtualXBox360Controller(UInputDevice):
     def __init__(
@@ -164,10 +414,14 @@ class VirtualXBox360Controller(UInputDevice):
 
 
 class DeviceManager:
+    # settings that can be changed without recreating the virtual device
+    MUTABLE_SETTINGS = frozenset(['presets', 'group_id'])
+
     def __init__(self, keybind_preset_library: dict[str, dict[str, str]]):
         self.keybind_preset_library = keybind_preset_library
         self.device_types: dict[str, type] = {
             'uinput': UInputDevice,
+            'raw_uinput': RawUInputDevice,
             'xbox360': VirtualXBox360Controller,
         }
 
@@ -202,24 +456,126 @@ class DeviceManager:
     def emit(self, device_id: str, event_name: str, value: int | float):
         if device_id not in self.device_map:
             raise ValueError(f'Unknown device: {device_id}')
-        self.device_map[device_id].emit(event_name, value)
+        device = self.device_map[device_id]
+        if device.update_key_state(event_name, value):
+            device.emit(event_name, value)
+
+    def resolve_presets(self, presets_names: list[str]) -> dict[str, list[tuple[str, str]]]:
+        # Get presets from library
+        return {
+            preset_name: self.keybind_preset_library[preset_name]
+            for preset_name in dict.fromkeys(presets_names) if preset_name in self.keybind_preset_library
+        }
+
+    def build_device(self, settings_name: str, settings: dict[str, int | str | list]) -> VirtualDevice:
+        device_params = copy.deepcopy(settings)
+        device_params['keybind_presets'] = self.resolve_presets(device_params.pop('presets', []))
+
+        device = self.create_device(settings_name, device_params)
+        device.settings_name = settings_name
+        device.settings = copy.deepcopy(settings)
+        return device
+
+    def add_device(self, device: VirtualDevice):
+        device.id = f'temp_{uuid.uuid4().hex}'
+        device.is_connected = False
+        self.device_map[device.id] = device
+
+    def remove_device(self, device: VirtualDevice):
+        self.device_map.pop(device.id, None)
+        device.close()
+        logger.info(f'Removed device: {device.name} ({device.id})')
 
     def initialize_devices(self, device_config: dict[str, dict[str, str]]):
         for device_name, device_params in device_config.items():
-            presets_names: set[str] = set(device_params.pop('presets', []))
-            # Get presets from library
-            presets = {
-                preset_name: self.keybind_preset_library[preset_name]
-                for preset_name in presets_names if preset_name in self.keybind_preset_library
-            }
-            device_params['keybind_presets'] = presets
+            self.add_device(self.build_device(device_name, device_params))
 
-            device = self.create_device(device_name, device_params.copy())
-            device.id = f'temp_{uuid.uuid4().hex}'
-            self.device_map[device.id] = device
+    def reload_devices(
+        self,
+        device_config: dict[str, dict[str, str]],
+        keybind_preset_library: dict[str, list[tuple[str, str]]],
+    ) -> list[tuple[str, VirtualDevice]]:
+        '''
+        Apply changed device settings and return the list of changes as (action, device).
+
+        Actions are "added", "removed", "updated" (name or presets changed), "recreated"
+        (capabilities changed) and "moved" (group changed, device needs to be registered again).
+        Virtual devices are only recreated when their capabilities change.
+        '''
+        self.keybind_preset_library = keybind_preset_library
+        changes: list[tuple[str, VirtualDevice]] = []
+
+        current_devices = {device.settings_name: device for device in self.device_map.values()}
+        removed = {name: device for name, device in current_devices.items() if name not in device_config}
+        added = {name: settings for name, settings in device_config.items() if name not in current_devices}
+        renamed: set[str] = set()
+
+        # entries with identical settings under a new name are renamed devices
+        for new_name, settings in list(added.items()):
+            for old_name, device in list(removed.items()):
+                if device.settings == settings:
+                    del added[new_name]
+                    del removed[old_name]
+                    device.settings_name = new_name
+                    device.name = new_name
+                    current_devices[new_name] = device
+                    renamed.add(new_name)
+                    logger.info(f'Renamed device "{old_name}" -> "{new_name}"')
+                    break
+
+        for device in removed.values():
+            self.remove_device(device)
+            changes.append(('removed', device))
+
+        for name, settings in device_config.items():
+            try:
+                if name in added:
+                    device = self.build_device(name, settings)
+                    self.add_device(device)
+                    changes.append(('added', device))
+                    continue
+
+                device = current_devices[name]
+                keybind_presets = self.resolve_presets(settings.get('presets', []))
+                if device.settings == settings and device.keybind_presets == keybind_presets and name not in renamed:
+                    continue
+
+                old_capabilities = {key: value for key, value in device.settings.items() if key not in self.MUTABLE_SETTINGS}
+                new_capabilities = {key: value for key, value in settings.items() if key not in self.MUTABLE_SETTINGS}
+                moved = device.settings.get('group_id') != settings.get('group_id')
+
+                if old_capabilities != new_capabilities:
+                    # recreate the virtual device, but keep the identity on the server
+                    new_device = self.build_device(name, settings)
+                    new_device.id = device.id
+                    new_device.name = device.name
+                    new_device.group_id = device.group_id
+                    new_device.is_connected = device.is_connected
+                    new_device.pending_update = device.pending_update
+                    device.close()
+                    self.device_map[new_device.id] = new_device
+                    device = new_device
+                    logger.info(f'Recreated device with changed capabilities: {device.name} ({device.id})')
+                else:
+                    device.keybind_presets = keybind_presets
+                    device.settings = copy.deepcopy(settings)
+
+                if moved:
+                    device.group_id = settings.get('group_id')
+                    changes.append(('moved', device))
+                elif old_capabilities != new_capabilities:
+                    changes.append(('recreated', device))
+                else:
+                    changes.append(('updated', device))
+            except Exception:
+                logger.exception(f'Failed to apply settings for device "{name}"')
+
+        return changes
 
 
 class ConnectionManager:
+    latency_report_interval = 5  # seconds
+
     def __init__(self, connection_details: dict[str, str | int | bool], device_manager: DeviceManager):
         host: str = connection_details.get('host', 'localhost')
         port: int = connection_details.get('port', 8000)
@@ -242,13 +598,22 @@ class ConnectionManager:
         self.device_manager = device_manager
         self.websocket: websockets.ClientConnection | None = None
         self.stop_event = asyncio.Event()
+        self.is_connected = False
+        self.uploaded_keybind_presets: dict[str, list[tuple[str, str]]] | None = None
+        self.latency_histograms: dict[str, dict[str, LatencyHistogram]] = {}
 
     async def handle_connection(self):
+        self.is_connected = True
+        self.uploaded_keybind_presets = None
+        await self.upload_keybind_presets()
+
         # Register devices
         for device in self.device_manager.device_map.values():
             if not device.is_connected:
                 await self.register_device(device)
 
+        report_task = asyncio.create_task(self.report_latency())
+
         # Message loop
         while not self.stop_event.is_set():
             try:
@@ -262,21 +627,121 @@ class ConnectionManager:
             except Exception:
                 logger.exception('Unexpected error during connection handling')
 
-        # reset devices
+        report_task.cancel()
+
+        # reset devices and release keys that were pressed when the connection was lost
+        self.is_connected = False
         for device in self.device_manager.device_map.values():
             device.is_connected = False
+            device.release_all_keys()
+
+    async def upload_keybind_presets(self):
+        '''Send the presets used by any device once, devices only reference them by name.'''
+        keybind_presets = {
+            preset_name: keybinds
+            for device in self.device_manager.device_map.values()
+            for preset_name, keybinds in device.keybind_presets.items()
+        }
+        if keybind_presets == self.uploaded_keybind_presets:
+            return
+
+        await self.websocket.send(json.dumps({
+            'type': 'keybind_preset_library',
+            'presets': keybind_presets,
+        }))
+        self.uploaded_keybind_presets = keybind_presets
+        logger.debug(f'Sent keybind preset library with {len(keybind_presets)} presets')
 
     async def register_device(self, device: VirtualDevice):
+        device.pending_update = None
         await self.websocket.send(json.dumps({
             'type': 'register_device',
             'temporary_id': device.id,
             'group_id': device.group_id,
             'device_name': device.name,
             'allowed_events': list(device.allowed_events),
-            'keybind_presets': device.keybind_presets,
+            'keybind_presets': list(device.keybind_presets),
         }))
         logger.debug(f'Sent registration for device: {device.name} ({device.id})')
 
+    async def update_device(self, device: VirtualDevice, is_recreated: bool = False):
+        data = {
+            'type': 'update_device',
+            'device_id': device.id,
+            'device_name': device.name,
+            'keybind_presets': list(device.keybind_presets),
+        }
+        # the server resets the key states of a device when its allowed events change
+        if is_recreated:
+            data['allowed_events'] = list(device.allowed_events)
+        await self.websocket.send(json.dumps(data))
+        logger.debug(f'Sent update for device: {device.name} ({device.id})')
+
+    async def unregister_device(self, device_id: str):
+        await self.websocket.send(json.dumps({
+            'type': 'unregister_device',
+            'device_id': device_id,
+        }))
+        logger.debug(f'Sent unregistration for device: {device_id}')
+
+    async def apply_device_changes(self, changes: list[tuple[str, VirtualDevice]]):
+        if self.is_connected and changes:
+            try:
+                await self.upload_keybind_presets()
+            except websockets.ConnectionClosed:
+                return
+
+        for action, device in changes:
+            try:
+                match action:
+                    case 'added':
+                        if self.is_connected:
+                            await self.register_device(device)
+                    case 'removed':
+                        if device.is_connected:
+                            await self.unregister_device(device.id)
+                    case 'moved':
+                        if device.is_connected:
+                            await self.unregister_device(device.id)
+                        self.device_manager.device_map.pop(device.id, None)
+                        self.device_manager.add_device(device)
+                        if self.is_connected:
+                            await self.register_device(device)
+                    case 'updated' | 'recreated':
+                        if device.is_connected:
+                            await self.update_device(device, is_recreated=action == 'recreated')
+                        elif self.is_connected and device.pending_update != 'recreated':
+                            # the registration is in flight, the update is sent once it is confirmed
+                            device.pending_update = action
+            except websockets.ConnectionClosed:
+                # all devices are registered with their current settings after reconnecting
+                pass
+
+    async def watch_settings(self, settings_loader: SettingsLoader, interval: float):
+        '''Poll the settings file and apply device changes without restarting.'''
+        while not self.stop_event.is_set():
+            await asyncio.sleep(interval)
+            if not settings_loader.has_changed():
+                continue
+
+            try:
+                config, changed = settings_loader.load()
+                if not changed:
+                    continue
+                if not isinstance(config, dict) or not config:
+                    # e.g. an editor truncates or replaces the file while saving, the next change applies again
+                    logger.warning(f'Settings file {settings_loader.path} is missing or empty, keeping current devices')
+                    continue
+                device_config: dict[str, dict] = config.get('devices', {})
+                keybind_preset_library = SettingsLoader.parse_keybind_preset_library(config)
+            except Exception:
+                logger.exception(f'Failed to reload settings from {settings_loader.path}, keeping current devices')
+                continue
+
+            logger.info(f'Settings file {settings_loader.path} changed, applying device changes')
+            changes = self.device_manager.reload_devices(device_config, keybind_preset_library)
+            await self.apply_device_changes(changes)
+
     async def handle_message(self, data: dict):
         msg_type = data.get('type')
 
@@ -287,7 +752,9 @@ class ConnectionManager:
             device = self.device_manager.device_map.pop(temporary_id, None)
 
             if not device:
+                # the device was probably removed from the settings while being registered
                 logger.warning(f'Unknown temporary device id: {temporary_id}')
+                await self.unregister_device(device_id)
                 return
 
             # Move from temp to real ID and set attribute
@@ -299,7 +766,14 @@ class ConnectionManager:
             logger.info(f'Device registered: {device.name} ({device.id}) in group {device.group_id}')
             logger.info(f'Open {self.url}/?group_id={device.group_id} to join group {device.group_id}')
 
+            # the settings changed after the registration was sent
+            if device.pending_update:
+                is_recreated = device.pending_update == 'recreated'
+                device.pending_update = None
+                await self.update_device(device, is_recreated=is_recreated)
+
         elif msg_type == 'key_event':
+            receive_time = time.time()
             device_id = data.get('device_id')
             event_name = data.get('code')
             value = int(data.get('state', 0))
@@ -307,6 +781,12 @@ class ConnectionManager:
                 self.device_manager.emit(device_id, event_name, value)
             except ValueError as error:
                 logger.warning(str(error))
+                return
+
+            if isinstance(data.get('trace'), dict):
+                # write batched events of traced key events right away, so the emit stage includes the write
+                self.device_manager.device_map[device_id].flush()
+                self.record_trace(device_id, data['trace'], receive_time, time.time())
 
         elif msg_type == 'rename_output':
             device_id = data.get('device_id')
@@ -320,8 +800,52 @@ class ConnectionManager:
             await self.websocket.send(json.dumps({
                 'type': 'pong',
                 'id': data.get('id'),
+                'client_time': time.time(),
             }))
 
+    def record_trace(self, device_id: str, trace: dict, receive_time: float, emit_time: float):
+        '''Record the latency stages of a traced key event (all timestamps in server clock).'''
+        clock_offset = trace.get('clock_offset')
+        client_send = trace.get('client_send')
+        server_receive = trace.get('server_receive')
+        server_send = trace.get('server_send')
+
+        stages: dict[str, float] = {'emit': emit_time - receive_time}
+        if server_receive is not None and server_send is not None:
+            stages['server'] = server_send - server_receive
+        if client_send is not None and server_receive is not None:
+            stages['uplink'] = server_receive - client_send
+        if clock_offset is not None:
+            receive_time -= clock_offset
+            emit_time -= clock_offset
+            if server_send is not None:
+                stages['downlink'] = receive_time - server_send
+            if client_send is not None:
+                stages['total'] = emit_time - client_send
+
+        histograms = self.latency_histograms.setdefault(device_id, {})
+        for stage, duration in stages.items():
+            histograms.setdefault(stage, LatencyHistogram()).record(duration * 1000)
+
+    async def report_latency(self):
+        '''Periodically send the latency histograms collected since the last report.'''
+        while True:
+            await asyncio.sleep(self.latency_report_interval)
+            if not self.latency_histograms:
+                continue
+
+            histograms, self.latency_histograms = self.latency_histograms, {}
+            try:
+                await self.websocket.send(json.dumps({
+                    'type': 'latency_report',
+                    'devices': {
+                        device_id: {stage: histogram.serialize() for stage, histogram in stages.items()}
+                        for device_id, stages in histograms.items()
+                    },
+                }))
+            except websockets.ConnectionClosed:
+                return
+
     async def connect(self):
         # Reconnect loop
         while not self.stop_event.is_set():
@@ -363,25 +887,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--settings', default='device_settings.yaml', help='YAML settings file')
     parser.add_argument('--log-level', default='INFO', help='Set logging level (DEBUG, INFO, WARNING, ERROR)')
+    parser.add_argument('--watch-interval', type=float, default=1.0, help='Seconds between checks for settings changes (0 disables reloading)')
     args = parser.parse_args()
 
     setup_logging(args.log_level)
 
-    config: dict[str, dict] = {}
-
-    settings_path = pathlib.Path(args.settings)
-    if settings_path.is_file():
-        with settings_path.open() as file:
-            config = yaml.safe_load(file) or {}
-    else:
+    settings_loader = SettingsLoader(pathlib.Path(args.settings))
+    config, _ = settings_loader.load()
+    if not settings_loader.path.is_file():
         logger.warning(f'Settings file not found: {args.settings}')
 
     connection_details: dict[str] = config.get('connection', {})
     device_config: dict[str, dict] = config.get('devices', {})
-    keybind_preset_library: dict[str, list[list]] = config.get('keybind_preset_library', {})
-    keybind_preset_library: dict[str, list[tuple[str, str]]] = {
-        preset_name: [(key, event) for key, event in keybinds] for preset_name, keybinds in keybind_preset_library.items()
-    }
+    keybind_preset_library = SettingsLoader.parse_keybind_preset_library(config)
 
     device_manager = DeviceManager(keybind_preset_library)
     device_manager.initialize_devices(device_config)
@@ -394,7 +912,13 @@ if __name__ == '__main__':
     for signal_type in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(signal_type, connection_manager.disconnect)
 
+    async def run():
+        tasks = [connection_manager.connect()]
+        if args.watch_interval > 0:
+            tasks.append(connection_manager.watch_settings(settings_loader, args.watch_interval))
+        await asyncio.gather(*tasks)
+
     try:
-        loop.run_until_complete(connection_manager.connect())
+        loop.run_until_complete(run())
     finally:
         loop.close()
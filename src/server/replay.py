@@ -0,0 +1,226 @@
+'''
+Replay a websocket traffic capture (recorded with DVC_CAPTURE_PATH) against a fresh in-process server
+and report handler times, sent bytes and keypress forwarding latency.
+
+    python replay.py capture.jsonl.gz [--speed 2] [--fast] [--json]
+'''
+import argparse
+import asyncio
+import collections
+import contextlib
+import gzip
+import json
+import os
+import sys
+import time
+
+os.environ.pop('DVC_CAPTURE_PATH', None)  # do not capture the replay itself
+
+import fastapi
+import server
+
+
+def load_capture(path: str):
+    '''Return the captured records, an incomplete last line of an interrupted capture is skipped.'''
+    opener = gzip.open if path.endswith('.gz') else open
+    records = []
+    with opener(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f'[WARNING] Skipping invalid capture line: {line[:80]!r}', file=sys.stderr)
+    return records
+
+
+def get_percentile(values: list[float], percentile: float):
+    return values[int(percentile * (len(values) - 1))] if values else None
+
+
+class FakeWebSocket:
+    '''In-process stand-in for a client connection, it answers pings and reports sent messages to the replay.'''
+
+    def __init__(self, replay: 'Replay', endpoint: str):
+        self.replay = replay
+        self.endpoint = endpoint
+        self.inbox: asyncio.Queue[str | None] = asyncio.Queue()
+        self.registrations: dict[str, asyncio.Future] = {}  # temporary id -> replayed (device id, group id)
+
+    def get_registration(self, temporary_id: str):
+        if temporary_id not in self.registrations:
+            self.registrations[temporary_id] = asyncio.get_running_loop().create_future()
+        return self.registrations[temporary_id]
+
+    def close(self):
+        self.inbox.put_nowait(None)
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        message = await self.inbox.get()
+        if message is None:
+            raise fastapi.WebSocketDisconnect()
+        return message
+
+    async def send_text(self, message: str):
+        self.replay.handle_server_message(self, message)
+
+
+class Replay:
+    registration_timeout = 5.0  # seconds
+
+    def __init__(self, records: list, speed: float | None):
+        self.records = records
+        self.speed = speed  # None replays as fast as possible
+        self.connections: dict[str, FakeWebSocket] = {}
+        self.connection_tasks: list[asyncio.Task] = []
+        self.device_ids: dict[str, str] = {}  # captured device id -> replayed device id
+        self.group_ids: dict[str, str] = {}  # captured group id -> replayed group id, for server generated ids
+        self.sent_messages: collections.Counter[str] = collections.Counter()
+        self.sent_bytes: collections.Counter[str] = collections.Counter()
+        self.forwarding_latencies: list[float] = []
+
+    def handle_server_message(self, websocket: FakeWebSocket, message: str):
+        data = json.loads(message)
+        message_type = data.get('type')
+        self.sent_messages[message_type] += 1
+        self.sent_bytes[message_type] += len(message.encode())
+
+        if message_type == 'ping':
+            websocket.inbox.put_nowait(json.dumps({'type': 'pong', 'id': data['id'], 'client_time': time.time()}))
+        elif message_type == 'device_registered':
+            registration = websocket.get_registration(data.get('temporary_id'))
+            if not registration.done():
+                registration.set_result((data['device_id'], data.get('group_id')))
+        elif message_type == 'key_event' and 'trace' in data:
+            self.forwarding_latencies.append((time.time() - data['trace']['server_receive']) * 1000)
+
+    def map_ids(self, data: dict):
+        if data.get('type') == 'join_group' and isinstance(data.get('group_id'), str):
+            data['group_id'] = self.group_ids.get(data['group_id'], data['group_id'])
+        for key in ('id', 'device_id'):
+            if isinstance(data.get(key), str):
+                data[key] = self.device_ids.get(data[key], data[key])
+        if data.get('type') == 'latency_report' and isinstance(data.get('devices'), dict):
+            data['devices'] = {self.device_ids.get(device_id, device_id): stages for device_id, stages in data['devices'].items()}
+
+    async def replay_record(self, connection_id: str, kind: str, message: str | None):
+        if kind == 'open':
+            websocket = self.connections[connection_id] = FakeWebSocket(self, message)
+            endpoint = server.ws_user if message == 'user' else server.ws_output
+            self.connection_tasks.append(asyncio.create_task(endpoint(websocket)))
+
+        elif kind == 'close':
+            if websocket := self.connections.pop(connection_id, None):
+                websocket.close()
+
+        elif kind == 'out':
+            # wait for the replayed registration to map the captured device and group id
+            websocket = self.connections.get(connection_id)
+            data = json.loads(message)
+            if not websocket or data.get('type') != 'device_registered':
+                return
+            registration = websocket.get_registration(data.get('temporary_id'))
+            try:
+                device_id, group_id = await asyncio.wait_for(registration, self.registration_timeout)
+                self.device_ids[data['device_id']] = device_id
+                if data.get('group_id') != group_id:
+                    self.group_ids[data['group_id']] = group_id
+            except asyncio.TimeoutError:
+                print(f'[WARNING] Device {data["device_id"]} was not registered during the replay', file=sys.stderr)
+            websocket.registrations.pop(data.get('temporary_id'), None)
+
+        elif kind == 'in':
+            websocket = self.connections.get(connection_id)
+            if not websocket:
+                return
+            data = json.loads(message)
+            self.map_ids(data)
+            if data.get('type') == 'keypress':
+                data['trace'] = {}  # the key event reports when the server received the keypress
+            websocket.inbox.put_nowait(json.dumps(data))
+
+    async def wait_until_idle(self):
+        groups = server.ConnectionManager.get().groups.values()
+        while any(not group.inbox.empty() for group in groups):
+            await asyncio.sleep(0.01)
+
+    async def run(self):
+        server.ConnectionManager.connection_manager = None
+        async with server.lifespan(server.app):
+            start_time = time.perf_counter()
+            capture_start_time = self.records[0][0] if self.records else 0.0
+            for record_time, connection_id, kind, message in self.records:
+                if self.speed:
+                    delay = (record_time - capture_start_time) / self.speed - (time.perf_counter() - start_time)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self.replay_record(connection_id, kind, message)
+                # let the server handle the message before the next one
+                await asyncio.sleep(0)
+
+            for websocket in self.connections.values():
+                websocket.close()
+            await asyncio.gather(*self.connection_tasks, return_exceptions=True)
+            await self.wait_until_idle()
+            duration = time.perf_counter() - start_time
+            loop_statistics = server.ConnectionManager.get().loop_monitor.serialize()
+
+        latencies = sorted(self.forwarding_latencies)
+        return {
+            'records': len(self.records),
+            'duration': duration,
+            'handlers': loop_statistics['handlers'],
+            'event_loop_lag': loop_statistics['lag'],
+            'sent_messages': dict(self.sent_messages),
+            'sent_bytes': dict(self.sent_bytes),
+            'total_sent_bytes': sum(self.sent_bytes.values()),
+            'keypress_forwarding_latency': {
+                'count': len(latencies),
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+                'p50': get_percentile(latencies, 0.5),
+                'p99': get_percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+
+
+def print_report(report: dict):
+    def format_ms(value):
+        return '-' if value is None else f'{value:.2f} ms'
+
+    print(f'Replayed {report["records"]} records in {report["duration"]:.2f} s')
+    print(f'Event loop lag: mean {format_ms(report["event_loop_lag"]["mean"])}, max {format_ms(report["event_loop_lag"]["max"])}')
+
+    print('\nHandlers (count, mean, max):')
+    for name, stats in sorted(report['handlers'].items(), key=lambda item: -item[1]['count'] * item[1]['mean']):
+        print(f'  {name:<28} {stats["count"]:>8} {format_ms(stats["mean"]):>12} {format_ms(stats["max"]):>12}')
+
+    print(f'\nSent messages (count, bytes), {report["total_sent_bytes"]} bytes in total:')
+    for message_type, count in sorted(report['sent_messages'].items(), key=lambda item: -report['sent_bytes'][item[0]]):
+        print(f'  {message_type:<28} {count:>8} {report["sent_bytes"][message_type]:>12}')
+
+    latency = report['keypress_forwarding_latency']
+    print(f'\nKeypress forwarding latency of {latency["count"]} key events: '
+          f'mean {format_ms(latency["mean"])}, p50 {format_ms(latency["p50"])}, '
+          f'p99 {format_ms(latency["p99"])}, max {format_ms(latency["max"])}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a captured websocket session against a fresh in-process server.')
+    parser.add_argument('capture', help='Path to the capture file (.jsonl or .jsonl.gz)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed factor relative to the captured timing (default: 1.0)')
+    parser.add_argument('--fast', action='store_true', help='Replay as fast as possible, ignoring the captured timing')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON, e.g. to compare server versions')
+    args = parser.parse_args()
+
+    replay = Replay(load_capture(args.capture), speed=None if args.fast else args.speed)
+    # server log messages go to stderr to keep the report separate
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(replay.run())
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
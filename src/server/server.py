@@ -1,7 +1,14 @@
 import asyncio
+import collections
 import contextlib
 import fastapi
+import gzip
+import hashlib
 import json
+import os
+import secrets
+import sys
+import threading
 import time
 import uuid
 
@@ -22,7 +29,311 @@ def is_too_white(hex_color: str, threshold: int = 240):
     return luminance > threshold
 
 
+class LatencyHistogram:
+    '''Aggregates latency histograms (in ms) reported by output clients.'''
+
+    def __init__(self):
+        self.bounds: list[float] = []
+        self.counts: list[int] = []
+        self.count = 0
+        self.sum = 0.0
+
+    def merge(self, data: dict):
+        bounds = [float(bound) for bound in data.get('bounds', [])]
+        counts = [int(count) for count in data.get('counts', [])]
+        if len(counts) != len(bounds) + 1:
+            raise ValueError('histogram needs exactly one more count than bounds')
+
+        if bounds != self.bounds:
+            # bucket layout changed (e.g. updated output client) -> start over
+            self.bounds = bounds
+            self.counts = [0] * len(counts)
+            self.count = 0
+            self.sum = 0.0
+
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.count += int(data.get('count', sum(counts)))
+        self.sum += float(data.get('sum', 0.0))
+
+    def get_percentile(self, fraction: float):
+        '''Return the upper bucket bound that contains the given fraction of samples, None in the overflow bucket.'''
+        if not self.count:
+            return None
+
+        threshold = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        # the percentile lies above the largest bound, reporting that bound would understate it
+        return None
+
+    def serialize(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.get_percentile(0.5),
+            'p95': self.get_percentile(0.95),
+            'p99': self.get_percentile(0.99),
+            'overflow': self.counts[-1] if self.counts else 0,
+            'bounds': self.bounds,
+            'counts': self.counts,
+        }
+
+
+class SamplingProfiler:
+    '''Periodically samples the call stack of the event loop thread from a background thread.'''
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks: collections.Counter[tuple[str, ...]] = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def serialize(self, limit: int = 20):
+        # self: samples where the function was executing, total: samples where it was on the stack
+        self_counts: collections.Counter[str] = collections.Counter()
+        total_counts: collections.Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            functions = [entry.rsplit(':', 1)[0] for entry in stack]
+            if functions:
+                self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+
+        return {
+            'samples': self.samples,
+            'interval': self.interval,
+            'self': self_counts.most_common(limit),
+            'total': total_counts.most_common(limit),
+            'stacks': [[list(stack), count] for stack, count in self.stacks.most_common(limit)],
+        }
+
+
+class LoopMonitor:
+    '''Continuously measures event loop lag and the run time of message handlers.'''
+    sample_interval = 0.05  # seconds
+    lag_threshold = 0.05  # seconds
+    handler_threshold = 0.05  # seconds
+    max_handler_names = 100
+
+    def __init__(self):
+        self.lags: collections.deque[float] = collections.deque(maxlen=1200)
+        self.max_lag = 0.0
+        self.handler_stats: dict[str, list[float]] = {}  # name -> [count, total time, max time]
+        self.slow_handlers: collections.deque[dict] = collections.deque(maxlen=100)
+        self.profiler: SamplingProfiler | None = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.sample_interval)
+            lag = loop.time() - start_time - self.sample_interval
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.lag_threshold:
+                print(f'[WARNING] Event loop lag of {lag * 1000:.1f} ms')
+
+    @contextlib.contextmanager
+    def track(self, name: str, get_group_id=lambda: None):
+        '''Measure the run time of a handler, the group id is looked up when the handler finished.'''
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+
+            # message types are client provided, do not let them grow the stats unbounded
+            if name not in self.handler_stats and len(self.handler_stats) >= self.max_handler_names:
+                name = 'other'
+            stats = self.handler_stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+
+            if duration > self.handler_threshold:
+                group_id = get_group_id()
+                # group ids are credentials, so they are only logged and not exposed by the metrics
+                self.slow_handlers.append({
+                    'name': name,
+                    'duration': duration * 1000,
+                    'time': time.time(),
+                })
+                print(f'[WARNING] Slow handler {name} in group {group_id} took {duration * 1000:.1f} ms')
+
+    def start_profiler(self, interval: float):
+        self.profiler = SamplingProfiler(threading.get_ident(), interval)
+        self.profiler.start()
+
+    def stop_profiler(self):
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        return profiler.serialize()
+
+    def serialize(self):
+        lags = sorted(self.lags)
+        return {
+            'lag': {
+                'last': self.lags[-1] * 1000 if self.lags else None,
+                'mean': sum(lags) / len(lags) * 1000 if lags else None,
+                'p99': lags[int(0.99 * (len(lags) - 1))] * 1000 if lags else None,
+                'max': self.max_lag * 1000,
+            },
+            'handlers': {
+                name: {'count': count, 'mean': total / count * 1000, 'max': maximum * 1000}
+                for name, (count, total, maximum) in self.handler_stats.items()
+            },
+            'slow_handlers': list(self.slow_handlers),
+        }
+
+
+class TrafficRecorder:
+    '''
+    Opt-in capture of the websocket traffic as JSON lines (gzip compressed for a .gz path) for replay.py.
+
+    Each line is [time, connection id, kind, message] with kind 'open' (message is the endpoint),
+    'in' (inbound message without pongs), 'out' (only device_registered to map device ids) or 'close'.
+    '''
+    flush_interval = 1.0  # seconds
+
+    def __init__(self, path: str):
+        opener = gzip.open if path.endswith('.gz') else open
+        self.file = opener(path, 'at', encoding='utf-8')
+        self.last_flush_time = time.time()
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get('DVC_CAPTURE_PATH')
+        if not path:
+            return None
+        print(f'[INFO] Capturing websocket traffic to {path}')
+        return cls(path)
+
+    def record(self, connection_id: str, kind: str, message: str | None = None):
+        now = time.time()
+        self.file.write(json.dumps([now, connection_id, kind, message], separators=(',', ':')) + '\n')
+        if now - self.last_flush_time >= self.flush_interval:
+            self.file.flush()
+            self.last_flush_time = now
+
+    def close(self):
+        self.file.close()
+
+
+class KeybindPresetStore:
+    '''Interns keybind presets by content hash, so identical presets are stored and sent only once.'''
+
+    def __init__(self):
+        self.presets: dict[str, list[list[str]]] = {}
+        self.reference_counts: dict[str, int] = {}
+
+    @staticmethod
+    def normalize(keybinds: list) -> list[list[str]]:
+        return [[str(key), str(event)] for key, event in keybinds]
+
+    def acquire(self, keybinds: list) -> str:
+        '''Store a preset (if new) and return its id.'''
+        keybinds = self.normalize(keybinds)
+        canonical = json.dumps(keybinds, separators=(',', ':'))
+        preset_id = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+        self.presets.setdefault(preset_id, keybinds)
+        return self.retain(preset_id)
+
+    def retain(self, preset_id: str) -> str:
+        self.reference_counts[preset_id] = self.reference_counts.get(preset_id, 0) + 1
+        return preset_id
+
+    def release(self, preset_id: str):
+        self.reference_counts[preset_id] -= 1
+        if self.reference_counts[preset_id] <= 0:
+            del self.reference_counts[preset_id]
+            del self.presets[preset_id]
+
+    def get_presets(self, preset_ids: set[str]):
+        return {preset_id: self.presets[preset_id] for preset_id in preset_ids if preset_id in self.presets}
+
+
+class KeyStateTable:
+    '''
+    Tracks the pressed keys of a device as bitmaps with the number of users holding each key.
+
+    Only real state transitions are forwarded: a key is pressed when the first user presses it
+    and released when the last user holding it releases it. Non key events are not tracked.
+    '''
+
+    def __init__(self, events: set[str]):
+        tracked_events = sorted(event for event in events if event.startswith(('BTN_', 'KEY_')))
+        self.event_indices: dict[str, int] = {event: index for index, event in enumerate(tracked_events)}
+        self.events: list[str] = tracked_events
+        self.holder_counts: list[int] = [0] * len(tracked_events)
+        self.user_keys: dict[str, int] = {}  # user id -> bitmap of held keys
+
+    def is_tracked(self, event: str):
+        return isinstance(event, str) and event in self.event_indices
+
+    def press(self, user_id: str, event: str):
+        '''Return True if the key was not pressed by anyone before.'''
+        index = self.event_indices[event]
+        user_keys = self.user_keys.get(user_id, 0)
+        if user_keys & (1 << index):
+            return False  # e.g. keyboard auto repeat
+
+        self.user_keys[user_id] = user_keys | (1 << index)
+        self.holder_counts[index] += 1
+        return self.holder_counts[index] == 1
+
+    def release(self, user_id: str, event: str):
+        '''Return True if the key is not pressed by anyone anymore.'''
+        index = self.event_indices[event]
+        user_keys = self.user_keys.get(user_id, 0)
+        if not user_keys & (1 << index):
+            return False
+
+        user_keys &= ~(1 << index)
+        if user_keys:
+            self.user_keys[user_id] = user_keys
+        else:
+            del self.user_keys[user_id]
+        self.holder_counts[index] -= 1
+        return self.holder_counts[index] == 0
+
+    def release_user(self, user_id: str):
+        '''Release all keys held by a user and return the keys that are not pressed by anyone anymore.'''
+        user_keys = self.user_keys.pop(user_id, 0)
+        released_events = []
+        for index, event in enumerate(self.events):
+            if user_keys & (1 << index):
+                self.holder_counts[index] -= 1
+                if self.holder_counts[index] == 0:
+                    released_events.append(event)
+        return released_events
+
+
 class User:
+    hidden_activity_interval = 5.0  # seconds, minimum activity update interval for hidden browser tabs
+
     def __init__(
         self,
         id: str,
@@ -41,10 +352,31 @@ class User:
         self.last_activity_time = time.time()
         self.connected_device_ids: dict[str, bool] = {}
         self.pings: list[float] = []
+        self.clock_offsets: list[float] = []
+        self.known_preset_ids: set[str] = set()
+
+        # activity and ping updates are only sent to subscribed users and only for changed entries
+        self.activity_interval: float | None = None  # seconds, None if not subscribed
+        self.is_hidden = False
+        self.last_activity_update_time = 0.0
+        self.sent_activity: dict[str, dict[str, list]] = {'users': {}, 'devices': {}}
 
     def get_ping_average(self):
         return sum(self.pings) / len(self.pings) if self.pings else None
 
+    def get_clock_offset(self):
+        '''Estimated difference between the user clock and the server clock in seconds.'''
+        return sum(self.clock_offsets) / len(self.clock_offsets) if self.clock_offsets else None
+
+    def is_activity_update_due(self, now: float):
+        if self.activity_interval is None:
+            return False
+
+        interval = self.activity_interval
+        if self.is_hidden:
+            interval = max(interval, self.hidden_activity_interval)
+        return now - self.last_activity_update_time >= interval
+
     def serialize(self):
         return {
             'id': self.id,
@@ -57,19 +389,47 @@ class User:
 
 
 class OutputDevice:
-    def __init__(self, id: str, websocket: fastapi.WebSocket, name: str, group_id: str, slot: int, keybind_presets: dict[str, list[tuple[str, str]]], allowed_events: set[str]):
+    def __init__(self, id: str, websocket: fastapi.WebSocket, name: str, group_id: str, slot: int, keybind_presets: dict[str, str], allowed_events: set[str]):
         self.id = id
         self.group_id = group_id
         self.websocket = websocket
         self.name = name or id
         self.slot = slot
-        self.keybind_presets: dict[str, list[tuple[str, str]]] = keybind_presets
+        self.keybind_presets: dict[str, str] = keybind_presets  # preset name -> preset id
         self.allowed_events: set[str] = allowed_events
+        self.key_states = KeyStateTable(allowed_events)
         self.pings: list[float] = []
+        self.clock_offsets: list[float] = []
+        self.latency_histograms: dict[str, LatencyHistogram] = {}
 
     def get_ping_average(self):
         return sum(self.pings) / len(self.pings) if self.pings else None
 
+    def get_clock_offset(self):
+        '''Estimated difference between the output client clock and the server clock in seconds.'''
+        return sum(self.clock_offsets) / len(self.clock_offsets) if self.clock_offsets else None
+
+    def set_keybind_presets(self, keybind_presets: dict[str, str]):
+        self.release_keybind_presets()
+        self.keybind_presets = keybind_presets
+
+    def release_keybind_presets(self):
+        for preset_id in self.keybind_presets.values():
+            ConnectionManager.get().keybind_presets.release(preset_id)
+        self.keybind_presets = {}
+
+    def merge_latency_report(self, stages: dict[str, dict]):
+        for stage, histogram_data in stages.items():
+            histogram = self.latency_histograms.setdefault(stage, LatencyHistogram())
+            histogram.merge(histogram_data)
+
+    def serialize_latency(self):
+        return {
+            'name': self.name,
+            'slot': self.slot,
+            'stages': {stage: histogram.serialize() for stage, histogram in self.latency_histograms.items()},
+        }
+
     def serialize(self, connected_users: list[str]):
         return {
             'id': self.id,
@@ -87,57 +447,299 @@ class OutputClient:
         self.id = id
         self.websocket = websocket
         self.devices: dict[str, OutputDevice] = {}
+        self.keybind_preset_library: dict[str, str] = {}  # preset name -> preset id
+        self.is_closed = False  # set on disconnect, groups drop its pending registrations and updates
+
+    def set_keybind_preset_library(self, keybind_preset_library: dict[str, list]):
+        store = ConnectionManager.get().keybind_presets
+        # validate all presets first to not leak references on invalid input
+        keybind_preset_library = {preset_name: store.normalize(keybinds) for preset_name, keybinds in keybind_preset_library.items()}
+        new_library = {preset_name: store.acquire(keybinds) for preset_name, keybinds in keybind_preset_library.items()}
+        self.release_keybind_preset_library()
+        self.keybind_preset_library = new_library
+
+    def release_keybind_preset_library(self):
+        store = ConnectionManager.get().keybind_presets
+        for preset_id in self.keybind_preset_library.values():
+            store.release(preset_id)
+        self.keybind_preset_library = {}
+
+    def intern_keybind_presets(self, keybind_presets: dict[str, list] | list[str]):
+        '''Return preset ids for full presets or for names of presets in the uploaded library.'''
+        store = ConnectionManager.get().keybind_presets
+        if isinstance(keybind_presets, dict):
+            keybind_presets = {preset_name: store.normalize(keybinds) for preset_name, keybinds in keybind_presets.items()}
+            return {preset_name: store.acquire(keybinds) for preset_name, keybinds in keybind_presets.items()}
+
+        return {
+            preset_name: store.retain(self.keybind_preset_library[preset_name])
+            for preset_name in keybind_presets if preset_name in self.keybind_preset_library
+        }
+
+    def remove_all_devices(self):
+        '''Remove all devices from their groups, e.g. after the output client disconnected.'''
+        output_device_ids_by_group: dict[str, list[str]] = {}
+        for output_device in self.devices.values():
+            output_device_ids_by_group.setdefault(output_device.group_id, []).append(output_device.id)
+
+        self.is_closed = True
+        self.devices.clear()
+        self.release_keybind_preset_library()
+        for group_id, output_device_ids in output_device_ids_by_group.items():
+            ConnectionManager.get().get_group(group_id).post('remove_devices', output_device_ids=output_device_ids)
+
 
-    async def connect_device(
-            self,
-            output_device_id: str,
-            group_id: str,
-            device_name: str,
-            allowed_events: set[str],
-            keybind_presets: dict[str, list[tuple[str, str]]],
+class Group:
+    '''
+    A group runs as an actor: all changes to its users and devices and all its broadcasts are
+    handled one after another by the group task, websocket handlers only post to its inbox.
+    '''
+    ping_change_threshold = 2.0  # ms, smaller ping changes are not sent as activity updates
+
+    def __init__(self, group_id: str):
+        self.id = group_id
+        self.users: dict[str, User] = {}
+        self.output_devices: dict[str, OutputDevice] = {}
+        self.inbox: asyncio.Queue[tuple[str, dict]] = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+        self.is_tick_pending = False
+
+        # every state broadcast bumps the version, the HTTP snapshot is only serialized once per version
+        self.state_version = 0
+        self.state_snapshot: tuple[int, bytes, str] | None = None  # version, body, etag
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def post(self, action: str, **arguments):
+        '''Queue an action for the group task, which calls handle_<action>(**arguments).'''
+        self.inbox.put_nowait((action, arguments))
+
+    async def run(self):
+        loop_monitor = ConnectionManager.get().loop_monitor
+        while True:
+            action, arguments = await self.inbox.get()
+            with loop_monitor.track(f'group.{action}', lambda: self.id):
+                try:
+                    await getattr(self, f'handle_{action}')(**arguments)
+                except Exception as error:
+                    print(f'[ERROR] Failed to handle {action} in group {self.id}: {error!r}')
+
+            # stop idle groups, a later join or registration creates the group again
+            if not self.users and not self.output_devices and self.inbox.empty():
+                groups = ConnectionManager.get().groups
+                if groups.get(self.id) is self:
+                    del groups[self.id]
+                print(f'[INFO] Removed empty group {self.id}')
+                return
+
+    async def handle_user_join(self, user: User):
+        self.users[user.id] = user
+        await self.broadcast_state()
+        print(f'[INFO] User {user.name} ({user.id}) joined group {self.id}')
+
+    async def handle_user_leave(self, user: User):
+        if self.users.pop(user.id, None) is None:
+            return
+
+        await self.release_keys(user)
+        await self.broadcast_state()
+        print(f'[INFO] User {user.name} ({user.id}) left group {self.id}')
+
+    async def handle_user_update(self, user: User):
+        if user.id in self.users:
+            await self.broadcast_state()
+
+    async def handle_select_output(self, user: User, device_id: str, state: bool):
+        if user.id not in self.users:
+            return
+
+        if device_id and device_id in self.output_devices:
+            if state:
+                user.connected_device_ids[device_id] = True
+            else:
+                user.connected_device_ids.pop(device_id, None)
+                await self.release_keys(user, [device_id])
+        user.last_activity_time = time.time()
+        await self.broadcast_state()
+
+    async def handle_keypress(self, user: User, data: dict, receive_time: float):
+        device_id = data.get('device_id')
+        if user.id not in self.users or device_id not in user.connected_device_ids or device_id not in self.output_devices:
+            return
+
+        selected_device = self.output_devices[device_id]
+        user.last_activity_time = time.time()
+
+        # Only forward real key state transitions of the merged state of all users
+        code = data.get('code')
+        state = data.get('state')
+        if selected_device.key_states.is_tracked(code):
+            if state:
+                changed = selected_device.key_states.press(user.id, code)
+            else:
+                changed = selected_device.key_states.release(user.id, code)
+            if not changed:
+                return
+
+        key_event = {
+            'type': 'key_event',
+            'device_id': selected_device.id,
+            'user_id': user.id,
+            'code': code,
+            'state': state,
+        }
+
+        # Opt-in latency tracing, all timestamps are converted to the server clock
+        trace = data.get('trace')
+        if isinstance(trace, dict):
+            client_send = trace.get('client_send')
+            user_clock_offset = user.get_clock_offset()
+            if isinstance(client_send, (int, float)) and user_clock_offset is not None:
+                client_send -= user_clock_offset
+            else:
+                client_send = None
+
+            key_event['trace'] = {
+                'client_send': client_send,
+                'server_receive': receive_time,
+                'server_send': time.time(),
+                'clock_offset': selected_device.get_clock_offset(),
+            }
+
+        await selected_device.websocket.send_text(json.dumps(key_event))
+
+    async def handle_rename_output(self, user: User, device_id: str, name: str):
+        if user.id not in self.users:
+            return
+
+        if device_id in self.output_devices and isinstance(name, str):
+            device = self.output_devices[device_id]
+            if name := name.strip():
+                device.name = name
+
+            await device.websocket.send_text(json.dumps({
+                'type': 'rename_output',
+                'device_id': device_id,
+                'name': device.name,
+            }))
+        user.last_activity_time = time.time()
+        await self.broadcast_state()
+
+    async def handle_register_device(
+        self,
+        output_client: 'OutputClient',
+        temporary_id: str,
+        device_name: str,
+        allowed_events: set[str],
+        keybind_presets: dict[str, list] | list[str],
     ):
-        group = await ConnectionManager.get().get_group(group_id)
+        # the output client disconnected before this registration was handled
+        if output_client.is_closed:
+            return
 
         # Find the lowest available slot number
-        used_slots = {device.slot for device in group.output_devices.values()}
+        used_slots = {device.slot for device in self.output_devices.values()}
         slot = 1
         while slot in used_slots:
             slot += 1
 
         output_device = OutputDevice(
-            id=output_device_id,
-            websocket=self.websocket,
+            id=f'output_{uuid.uuid4().hex[:4]}',
+            websocket=output_client.websocket,
             name=device_name,
-            group_id=group.id,
+            group_id=self.id,
             slot=slot,
-            keybind_presets=keybind_presets,
+            keybind_presets=output_client.intern_keybind_presets(keybind_presets),
             allowed_events=allowed_events,
         )
-        group.output_devices[output_device.id] = output_device
-        self.devices[output_device.id] = output_device
-        return output_device
+        self.output_devices[output_device.id] = output_device
+        output_client.devices[output_device.id] = output_device
+
+        message = json.dumps({
+            'type': 'device_registered',
+            'device_id': output_device.id,
+            'temporary_id': temporary_id,
+            'group_id': output_device.group_id,
+            'slot': output_device.slot,
+        })
+        await output_device.websocket.send_text(message)
+        ConnectionManager.get().record(output_client.id, 'out', message)
+
+        await self.broadcast_state()
+        print(f'[INFO] Device {output_device.id} registered in group {self.id} with slot {output_device.slot}')
+
+    async def handle_update_device(self, output_client: 'OutputClient', output_device_id: str, data: dict):
+        device = self.output_devices.get(output_device_id)
+        if not device or output_client.is_closed:
+            return
+
+        device_name = data.get('device_name')
+        if isinstance(device_name, str) and device_name.strip():
+            device.name = device_name.strip()
+        allowed_events = data.get('allowed_events')
+        if 'allowed_events' in data:
+            if not isinstance(allowed_events, list) or not all(isinstance(event, str) for event in allowed_events):
+                print(f'[WARNING] Invalid allowed events for device {device.id}: {allowed_events!r:.100}')
+            elif set(allowed_events) != set(device.allowed_events):
+                key_states = KeyStateTable(allowed_events)
+                # release held keys before the key states are tracked for the changed capabilities
+                for user_id in list(device.key_states.user_keys):
+                    await self.release_device_keys(device, user_id)
+                device.allowed_events = allowed_events
+                device.key_states = key_states
+        if 'keybind_presets' in data:
+            try:
+                device.set_keybind_presets(output_client.intern_keybind_presets(data.get('keybind_presets') or {}))
+            except (TypeError, ValueError) as error:
+                print(f'[WARNING] Invalid keybind presets for device {device.id}: {error}')
+
+        await self.broadcast_state()
+        print(f'[INFO] Device {device.id} updated in group {self.id}')
 
-    async def remove_all_devices(self):
-        groups: set[Group] = set()
+    async def handle_remove_devices(self, output_device_ids: list[str]):
+        for output_device_id in output_device_ids:
+            device = self.output_devices.pop(output_device_id, None)
+            if not device:
+                continue
 
-        for device in self.devices.values():
-            group = await ConnectionManager.get().get_group(device.group_id)
-            for user in group.users.values():
+            device.release_keybind_presets()
+            for user in self.users.values():
                 user.connected_device_ids.pop(device.id, None)
-            group.output_devices.pop(device.id, None)
-            print(f'[INFO] Device {device.id} (slot {device.slot}) removed from group {group.id}')
-            groups.add(group)
+            print(f'[INFO] Device {device.id} (slot {device.slot}) removed from group {self.id}')
 
-        self.devices.clear()
-        for group in groups:
-            await group.broadcast_to_users(json.dumps(group.serialize_state()))
+        await self.broadcast_state()
 
+    async def handle_tick(self):
+        self.is_tick_pending = False
 
-class Group:
-    def __init__(self, group_id: str):
-        self.id = group_id
-        self.users: dict[str, User] = {}
-        self.output_devices: dict[str, OutputDevice] = {}
+        # Ping all users
+        for user in list(self.users.values()):
+            await ConnectionManager.get().send_ping(user.id, user.websocket)
+
+        # Send changed activity and ping values to subscribed users whose update interval passed
+        now = time.time()
+        activity = None
+        for user in list(self.users.values()):
+            if not user.is_activity_update_due(now):
+                continue
+
+            if activity is None:
+                activity = self.get_activity_and_ping()
+            changed_activity = self.get_changed_activity(activity, user.sent_activity)
+            if not changed_activity['users'] and not changed_activity['devices']:
+                continue
+
+            try:
+                await user.websocket.send_text(json.dumps({
+                    'type': 'activity_and_ping',
+                    **changed_activity,
+                }))
+            except Exception:
+                continue
+            user.last_activity_update_time = now
+            user.sent_activity['users'].update(changed_activity['users'])
+            user.sent_activity['devices'].update(changed_activity['devices'])
 
     def serialize_state(self):
         users_data = [user.serialize() for user in self.users.values()]
@@ -159,16 +761,78 @@ class Group:
             'devices': output_devices_data,
         }
 
-    def serialize_activity_and_ping(self):
-        users = {user.id: [user.last_activity_time, user.get_ping_average()] for user in self.users.values()}
-        output_devices = {output_device.id: [output_device.get_ping_average()] for output_device in self.output_devices.values()}
+    def get_preset_ids(self):
+        return {
+            preset_id
+            for output_device in self.output_devices.values()
+            for preset_id in output_device.keybind_presets.values()
+        }
 
+    def get_state_snapshot(self):
+        '''
+        Return the group state including its keybind presets as JSON body and its ETag.
+        The snapshot is cached until the state changes, so activity and ping values can be older.
+        '''
+        if self.state_snapshot is None or self.state_snapshot[0] != self.state_version:
+            state = self.serialize_state()
+            state['version'] = self.state_version
+            state['keybind_presets'] = ConnectionManager.get().keybind_presets.get_presets(self.get_preset_ids())
+            body = json.dumps(state).encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            self.state_snapshot = (self.state_version, body, etag)
+        return self.state_snapshot[1], self.state_snapshot[2]
+
+    def get_activity_and_ping(self):
         return {
-            'type': 'activity_and_ping',
-            'users': users,
-            'devices': output_devices,
+            'users': {user.id: [user.last_activity_time, user.get_ping_average()] for user in self.users.values()},
+            'devices': {output_device.id: [output_device.get_ping_average()] for output_device in self.output_devices.values()},
         }
 
+    @classmethod
+    def has_ping_changed(cls, old_ping: float | None, new_ping: float | None):
+        if old_ping is None or new_ping is None:
+            return old_ping != new_ping
+        return abs(new_ping - old_ping) >= cls.ping_change_threshold
+
+    def get_changed_activity(self, activity: dict[str, dict[str, list]], sent_activity: dict[str, dict[str, list]]):
+        '''Return the entries of activity that changed noticeably compared to the sent ones.'''
+        changed_users = {}
+        for user_id, (last_activity_time, ping) in activity['users'].items():
+            sent_values = sent_activity['users'].get(user_id)
+            if sent_values is None or sent_values[0] != last_activity_time or self.has_ping_changed(sent_values[1], ping):
+                changed_users[user_id] = [last_activity_time, ping]
+
+        changed_devices = {}
+        for device_id, (ping,) in activity['devices'].items():
+            sent_values = sent_activity['devices'].get(device_id)
+            if sent_values is None or self.has_ping_changed(sent_values[0], ping):
+                changed_devices[device_id] = [ping]
+
+        return {'users': changed_users, 'devices': changed_devices}
+
+    async def release_keys(self, user: User, device_ids: list[str] | None = None):
+        '''Release the keys a user holds on the given (or all) devices of the group.'''
+        if device_ids is None:
+            device_ids = list(self.output_devices)
+
+        for device_id in device_ids:
+            output_device = self.output_devices.get(device_id)
+            if output_device:
+                await self.release_device_keys(output_device, user.id)
+
+    async def release_device_keys(self, output_device: OutputDevice, user_id: str):
+        for event in output_device.key_states.release_user(user_id):
+            try:
+                await output_device.websocket.send_text(json.dumps({
+                    'type': 'key_event',
+                    'device_id': output_device.id,
+                    'user_id': user_id,
+                    'code': event,
+                    'state': 0,
+                }))
+            except Exception:
+                pass
+
     async def broadcast(self, message: str, receivers: list[User | OutputDevice] = None):
         if receivers is None:
             receivers = list(self.users.values()) + list(self.output_devices.values())
@@ -179,6 +843,29 @@ class Group:
             except Exception:
                 pass
 
+    async def broadcast_state(self):
+        '''Broadcast the group state to all users, preceded by the keybind presets they do not know yet.'''
+        self.state_version += 1
+        message = json.dumps(self.serialize_state())
+        activity = self.get_activity_and_ping()
+        preset_ids = self.get_preset_ids()
+
+        for user in list(self.users.values()):
+            try:
+                unknown_preset_ids = preset_ids - user.known_preset_ids
+                if unknown_preset_ids:
+                    await user.websocket.send_text(json.dumps({
+                        'type': 'keybind_presets',
+                        'presets': ConnectionManager.get().keybind_presets.get_presets(unknown_preset_ids),
+                    }))
+                    user.known_preset_ids |= unknown_preset_ids
+                await user.websocket.send_text(message)
+
+                # the group state contains the current activity and ping values as well
+                user.sent_activity = {'users': dict(activity['users']), 'devices': dict(activity['devices'])}
+            except Exception:
+                pass
+
     async def broadcast_to_users(self, message: str):
         await self.broadcast(message, list(self.users.values()))
 
@@ -194,8 +881,10 @@ class ConnectionManager:
         self.users: dict[str, User] = {}
         self.output_clients: dict[str, OutputClient] = {}
         self.groups: dict[str, Group] = {}
-        self.groups_lock = asyncio.Lock()
         self.pending_pings: dict[str, tuple[str, float]] = {}
+        self.keybind_presets = KeybindPresetStore()
+        self.loop_monitor = LoopMonitor()
+        self.recorder = TrafficRecorder.from_environment()
 
     @classmethod
     def get(cls):
@@ -203,62 +892,53 @@ class ConnectionManager:
             cls.connection_manager = ConnectionManager()
         return cls.connection_manager
 
-    async def get_group(self, group_id: str):
-        async with self.groups_lock:
-            if group_id not in self.groups:
-                self.groups[group_id] = Group(group_id)
-            return self.groups[group_id]
+    def record(self, connection_id: str, kind: str, message: str | None = None):
+        if self.recorder:
+            self.recorder.record(connection_id, kind, message)
 
-    async def ping_monitor(self):
-        i = 0
-        while True:
-            await asyncio.sleep(self.ping_interval)
-            for group in self.groups.values():
-                # Ping all users
-                for user_id, user in group.users.items():
-                    try:
-                        ping_id = str(uuid.uuid4())
-                        start_time = time.time()
-
-                        # Store pending ping
-                        self.pending_pings[user_id] = (ping_id, start_time)
-
-                        await user.websocket.send_text(json.dumps({
-                            'type': 'ping',
-                            'id': ping_id
-                        }))
-                    except Exception:
-                        self.pending_pings.pop(user_id, None)
-
-                # Ping all output clients
-                for output_client_id, output_client in self.output_clients.items():
-                    try:
-                        ping_id = str(uuid.uuid4())
-                        start_time = time.time()
+    def get_group(self, group_id: str):
+        '''Return the group with the given id, a new group is created and its task started.'''
+        group = self.groups.get(group_id)
+        if group is None:
+            group = self.groups[group_id] = Group(group_id)
+            group.start()
+        return group
 
-                        # Store pending ping
-                        self.pending_pings[output_client_id] = (ping_id, start_time)
+    async def send_ping(self, receiver_id: str, websocket: fastapi.WebSocket):
+        try:
+            ping_id = str(uuid.uuid4())
+            start_time = time.time()
 
-                        await output_client.websocket.send_text(json.dumps({
-                            'type': 'ping',
-                            'id': ping_id
-                        }))
-                    except Exception:
-                        self.pending_pings.pop(output_client_id, None)
-
-            # Clean up old pending pings
-            cutoff_time = time.time() - 3 * self.ping_interval
-            self.pending_pings = {
-                k: v for k, v in self.pending_pings.items()
-                if v[1] > cutoff_time
-            }
+            # Store pending ping
+            self.pending_pings[receiver_id] = (ping_id, start_time)
 
-            if i < 10:
-                i += 1
-                continue
+            await websocket.send_text(json.dumps({
+                'type': 'ping',
+                'id': ping_id
+            }))
+        except Exception:
+            self.pending_pings.pop(receiver_id, None)
 
-            for group in self.groups.values():
-                await group.broadcast_to_users(json.dumps(group.serialize_activity_and_ping()))
+    async def ping_monitor(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            with self.loop_monitor.track('ping_monitor'):
+                # Ping all output clients
+                for output_client_id, output_client in list(self.output_clients.items()):
+                    await self.send_ping(output_client_id, output_client.websocket)
+
+                # Clean up old pending pings
+                cutoff_time = time.time() - 3 * self.ping_interval
+                self.pending_pings = {
+                    k: v for k, v in self.pending_pings.items()
+                    if v[1] > cutoff_time
+                }
+
+                # Users are pinged by their group task, skip groups that did not handle the last tick yet
+                for group in self.groups.values():
+                    if not group.is_tick_pending:
+                        group.is_tick_pending = True
+                        group.post('tick')
 
     async def handle_pong(self, sender_id: str, pong_data: dict):
         'Handle pong response from user or device'
@@ -270,33 +950,149 @@ class ConnectionManager:
         if pending_ping:
             expected_ping_id, start_time = pending_ping
             if ping_id == expected_ping_id:
-                ping_ms = (time.time() - start_time) * 1000
+                end_time = time.time()
+                ping_ms = (end_time - start_time) * 1000
+
+                # Estimate clock offset, assuming the pong was sent halfway through the round trip
+                clock_offset = None
+                client_time = pong_data.get('client_time')
+                if isinstance(client_time, (int, float)):
+                    clock_offset = client_time - (start_time + end_time) / 2
 
                 # Update ping for user or device
                 if sender_id in self.users:
-                    self.users[sender_id].pings.append(ping_ms)
-                    if len(self.users[sender_id].pings) > 10:
-                        self.users[sender_id].pings = self.users[sender_id].pings[-10:]
+                    user = self.users[sender_id]
+                    user.pings.append(ping_ms)
+                    if len(user.pings) > 10:
+                        user.pings = user.pings[-10:]
+                    if clock_offset is not None:
+                        user.clock_offsets.append(clock_offset)
+                        if len(user.clock_offsets) > 10:
+                            user.clock_offsets = user.clock_offsets[-10:]
                 elif sender_id in self.output_clients:
                     for device in self.output_clients[sender_id].devices.values():
                         device.pings.append(ping_ms)
                         if len(device.pings) > 10:
                             device.pings = device.pings[-10:]
+                        if clock_offset is not None:
+                            device.clock_offsets.append(clock_offset)
+                            if len(device.clock_offsets) > 10:
+                                device.clock_offsets = device.clock_offsets[-10:]
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
-    task = asyncio.create_task(ConnectionManager.get().ping_monitor())
+    tasks = [
+        asyncio.create_task(ConnectionManager.get().ping_monitor()),
+        asyncio.create_task(ConnectionManager.get().loop_monitor.run()),
+    ]
     try:
         yield
     finally:
-        task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await task
+        tasks += [group.task for group in ConnectionManager.get().groups.values() if group.task]
+        for task in tasks:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        if ConnectionManager.get().recorder:
+            ConnectionManager.get().recorder.close()
 
 app = fastapi.FastAPI(lifespan=lifespan)
 
 
+def verify_admin_token(authorization: str | None = fastapi.Header(None)):
+    '''Admin endpoints are only available when DVC_ADMIN_TOKEN is set and require it as bearer token.'''
+    admin_token = os.environ.get('DVC_ADMIN_TOKEN')
+    if not admin_token:
+        raise fastapi.HTTPException(status_code=404)
+    if not authorization or not secrets.compare_digest(authorization, f'Bearer {admin_token}'):
+        raise fastapi.HTTPException(status_code=401, detail='Invalid admin token')
+
+
+# === Metrics ===
+@app.get('/metrics/latency', dependencies=[fastapi.Depends(verify_admin_token)])
+async def latency_metrics():
+    '''Per group and device breakdown of the traced key event latency stages, group ids are credentials.'''
+    return {
+        group.id: {
+            device.id: device.serialize_latency()
+            for device in group.output_devices.values()
+        }
+        for group in ConnectionManager.get().groups.values()
+    }
+
+
+@app.get('/metrics/event_loop')
+async def event_loop_metrics():
+    '''Event loop lag, handler run times and recent slow handlers.'''
+    return ConnectionManager.get().loop_monitor.serialize()
+
+
+# === Groups ===
+@app.get('/groups/{group_id}/state')
+async def group_state(group_id: str, if_none_match: str | None = fastapi.Header(None)):
+    '''Read-only snapshot of the group state, the caller does not join the group.'''
+    group = ConnectionManager.get().groups.get(group_id)
+    if not group:
+        raise fastapi.HTTPException(status_code=404, detail='Unknown group')
+
+    body, etag = group.get_state_snapshot()
+    headers = {'ETag': etag, 'Cache-Control': 'max-age=1'}
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return fastapi.Response(status_code=304, headers=headers)
+    return fastapi.Response(body, media_type='application/json', headers=headers)
+
+
+@app.get('/groups', dependencies=[fastapi.Depends(verify_admin_token)])
+async def groups(response: fastapi.Response):
+    '''All groups with their state version and number of users and devices.'''
+    response.headers['Cache-Control'] = 'no-store'
+    return [
+        {
+            'group_id': group.id,
+            'version': group.state_version,
+            'users': len(group.users),
+            'devices': len(group.output_devices),
+        }
+        for group in ConnectionManager.get().groups.values()
+    ]
+
+
+# === Admin ===
+@app.post('/admin/profile', dependencies=[fastapi.Depends(verify_admin_token)])
+async def profile(duration: float = 5.0, interval: float = 0.005):
+    '''Sample the event loop thread for the given duration and return the hottest functions and stacks.'''
+    loop_monitor = ConnectionManager.get().loop_monitor
+    if loop_monitor.profiler:
+        raise fastapi.HTTPException(status_code=409, detail='Profiler is already running')
+    if not 0 < duration <= 60 or not 0.001 <= interval <= 1:
+        raise fastapi.HTTPException(status_code=422, detail='Use 0 < duration <= 60 and 0.001 <= interval <= 1')
+
+    loop_monitor.start_profiler(interval)
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        result = loop_monitor.stop_profiler()
+    print(f'[INFO] Profiled event loop for {duration} s with {result["samples"]} samples')
+    return result
+
+
+# message types are client provided, handler names in the loop monitor only use the known ones
+USER_MESSAGE_TYPES = {
+    'update_user_data', 'join_group', 'leave_group', 'select_output', 'keypress',
+    'rename_output', 'subscribe_activity', 'visibility', 'pong',
+}
+OUTPUT_MESSAGE_TYPES = {
+    'register_device', 'keybind_preset_library', 'update_device', 'unregister_device', 'latency_report', 'pong',
+}
+
+
+def get_handler_name(endpoint: str, message_type, known_message_types: set[str]):
+    if not isinstance(message_type, str) or message_type not in known_message_types:
+        message_type = 'other'
+    return f'{endpoint}.{message_type}'
+
+
 # === User WebSocket ===
 @app.websocket('/ws/user')
 async def ws_user(websocket: fastapi.WebSocket):
@@ -306,6 +1102,7 @@ async def ws_user(websocket: fastapi.WebSocket):
         websocket=websocket,
     )
     ConnectionManager.get().users[user.id] = user
+    ConnectionManager.get().record(user.id, 'open', 'user')
     print(f'[INFO] User {user.name} ({user.id}) started connection')
 
     group: Group | None = None
@@ -319,100 +1116,78 @@ async def ws_user(websocket: fastapi.WebSocket):
         try:
             message = await websocket.receive_text()
             incoming_data: dict[str, str] = json.loads(message)
+            if incoming_data.get('type') != 'pong':
+                ConnectionManager.get().record(user.id, 'in', message)
+
+            # Group changes are handled by the group task, this loop only decodes and posts them
+            handler_name = get_handler_name('user', incoming_data.get('type'), USER_MESSAGE_TYPES)
+            with ConnectionManager.get().loop_monitor.track(handler_name, lambda: group and group.id):
+                if incoming_data.get('type') == 'update_user_data':
+                    user.name = incoming_data.get('name')
+                    color = incoming_data.get('color').lower().strip()
+                    if color != '' and not is_too_white(color):
+                        user.color = color
+                    user.last_activity_time = time.time()
+                    if group:
+                        group.post('user_update', user=user)
+                    else:
+                        await websocket.send_text(json.dumps({
+                            'type': 'config',
+                            'user_id': user.id,
+                            'user_name': user.name,
+                            'user_color': user.color,
+                        }))
 
-            if incoming_data.get('type') == 'update_user_data':
-                user.name = incoming_data.get('name')
-                color = incoming_data.get('color').lower().strip()
-                if color != '' and not is_too_white(color):
-                    user.color = color
-                user.last_activity_time = time.time()
-                if group:
-                    await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                else:
-                    await websocket.send_text(json.dumps({
-                        'type': 'config',
-                        'user_id': user.id,
-                        'user_name': user.name,
-                        'user_color': user.color,
-                    }))
+                elif incoming_data.get('type') == 'join_group':
+                    if group:
+                        group.post('user_leave', user=user)
 
-            elif incoming_data.get('type') == 'join_group':
-                if group:
-                    group.users.pop(user.id, None)
-                    await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                    print(f'[INFO] User {user.name} ({user.id}) left group {group.id}')
+                    group_id = incoming_data.get('group_id')
+                    if not group_id:
+                        group_id = uuid.uuid4().hex
 
-                group_id = incoming_data.get('group_id')
-                if not group_id:
-                    group_id = uuid.uuid4().hex
+                    group = ConnectionManager.get().get_group(group_id)
+                    group.post('user_join', user=user)
 
-                group = await ConnectionManager.get().get_group(group_id)
-                group.users[user.id] = user
+                elif incoming_data.get('type') == 'leave_group':
+                    if not group:
+                        continue
 
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                print(f'[INFO] User {user.name} ({user.id}) joined group {group.id}')
+                    group.post('user_leave', user=user)
+                    group = None
 
-            elif incoming_data.get('type') == 'leave_group':
-                if not group:
-                    continue
+                elif incoming_data.get('type') == 'select_output':
+                    if not group:
+                        continue
 
-                group.users.pop(user.id, None)
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                print(f'[INFO] User {user.name} ({user.id}) left group {group.id}')
-                group = None
+                    group.post('select_output', user=user, device_id=incoming_data.get('id'), state=incoming_data.get('state'))
 
-            elif incoming_data.get('type') == 'select_output':
-                if not group:
-                    continue
+                elif incoming_data.get('type') == 'keypress':
+                    if not group:
+                        continue
 
-                selected_device = incoming_data.get('id')
-                state = incoming_data.get('state')
-                if selected_device and selected_device in group.output_devices:
-                    if state:
-                        user.connected_device_ids[selected_device] = True
-                    else:
-                        user.connected_device_ids.pop(selected_device, None)
-                user.last_activity_time = time.time()
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
+                    group.post('keypress', user=user, data=incoming_data, receive_time=time.time())
 
-            elif incoming_data.get('type') == 'keypress':
-                device_id = incoming_data.get('device_id')
-                if not group or device_id not in user.connected_device_ids or device_id not in group.output_devices:
-                    continue
+                elif incoming_data.get('type') == 'rename_output':
+                    if not group:
+                        continue
 
-                selected_device = group.output_devices[device_id]
+                    group.post('rename_output', user=user, device_id=incoming_data.get('id'), name=incoming_data.get('name'))
 
-                await selected_device.websocket.send_text(json.dumps({
-                    'type': 'key_event',
-                    'device_id': selected_device.id,
-                    'user_id': user.id,
-                    'code': incoming_data.get('code'),
-                    'state': incoming_data.get('state'),
-                }))
-                user.last_activity_time = time.time()
-
-            elif incoming_data.get('type') == 'rename_output':
-                if not group:
-                    continue
-
-                target_id = incoming_data.get('id')
-                new_name = incoming_data.get('name')
-                if target_id in group.output_devices and isinstance(new_name, str):
-                    device = group.output_devices[target_id]
-                    if new_name := new_name.strip():
-                        device.name = new_name
-                    target_ws = device.websocket
-
-                    await target_ws.send_text(json.dumps({
-                        'type': 'rename_output',
-                        'device_id': target_id,
-                        'name': device.name,
-                    }))
-                user.last_activity_time = time.time()
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
+                elif incoming_data.get('type') == 'subscribe_activity':
+                    interval = incoming_data.get('interval')
+                    if isinstance(interval, (int, float)) and interval > 0:
+                        user.activity_interval = max(float(interval), ConnectionManager.ping_interval)
+                    else:
+                        user.activity_interval = None
+                    # send all entries with the next update
+                    user.sent_activity = {'users': {}, 'devices': {}}
+
+                elif incoming_data.get('type') == 'visibility':
+                    user.is_hidden = bool(incoming_data.get('hidden'))
 
-            elif incoming_data.get('type') == 'pong':
-                await ConnectionManager.get().handle_pong(user.id, incoming_data)
+                elif incoming_data.get('type') == 'pong':
+                    await ConnectionManager.get().handle_pong(user.id, incoming_data)
 
         except (
             RuntimeError,
@@ -422,10 +1197,9 @@ async def ws_user(websocket: fastapi.WebSocket):
                 print(f'[ERROR] received message on closed connection (probably due to a race condition between shortly timed normal and close message): {error}')
 
             if group:
-                group.users.pop(user.id, None)
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                print(f'[INFO] User {user.name} ({user.id}) left group {group.id}')
+                group.post('user_leave', user=user)
             ConnectionManager.get().users.pop(user.id, None)
+            ConnectionManager.get().record(user.id, 'close')
             print(f'[INFO] User {user.name} ({user.id}) disconnected')
 
             break
@@ -441,50 +1215,71 @@ async def ws_output(websocket: fastapi.WebSocket):
         websocket=websocket,
     )
     ConnectionManager.get().output_clients[output_client.id] = output_client
+    ConnectionManager.get().record(output_client.id, 'open', 'output')
 
     while True:
         try:
             message = await websocket.receive_text()
             incoming_data: dict = json.loads(message)
-
-            if incoming_data.get('type') == 'register_device':
-                try:
-                    temporary_id = incoming_data.get('temporary_id')
-                    output_device_id = f'output_{uuid.uuid4().hex[:4]}'
+            if incoming_data.get('type') != 'pong':
+                ConnectionManager.get().record(output_client.id, 'in', message)
+            group: Group | None = None
+
+            # Group changes are handled by the group task, this loop only decodes and posts them
+            handler_name = get_handler_name('output', incoming_data.get('type'), OUTPUT_MESSAGE_TYPES)
+            with ConnectionManager.get().loop_monitor.track(handler_name, lambda: group and group.id):
+                if incoming_data.get('type') == 'register_device':
                     group_id = incoming_data.get('group_id') or uuid.uuid4().hex
-                    device_name = incoming_data.get('device_name')
-                    allowed_events = incoming_data.get('allowed_events')
-                    keybind_presets = incoming_data.get('keybind_presets')
-                except Exception as error:
-                    print(f'Error registering device: {error}')
-                    continue
-
-                output_device = await output_client.connect_device(
-                    output_device_id=output_device_id,
-                    group_id=group_id,
-                    device_name=device_name,
-                    allowed_events=allowed_events,
-                    keybind_presets=keybind_presets,
-                )
-
-                await output_device.websocket.send_text(json.dumps({
-                    'type': 'device_registered',
-                    'device_id': output_device.id,
-                    'temporary_id': temporary_id,
-                    'group_id': output_device.group_id,
-                    'slot': output_device.slot,
-                }))
-
-                group = await ConnectionManager.get().get_group(output_device.group_id)
-                await group.broadcast_to_users(json.dumps(group.serialize_state()))
-                print(f'[INFO] Device {output_device.id} registered in group {group.id} with slot {output_device.slot}')
-
-            elif incoming_data.get('type') == 'pong':
-                await ConnectionManager.get().handle_pong(output_client.id, incoming_data)
+                    group = ConnectionManager.get().get_group(group_id)
+                    group.post(
+                        'register_device',
+                        output_client=output_client,
+                        temporary_id=incoming_data.get('temporary_id'),
+                        device_name=incoming_data.get('device_name'),
+                        allowed_events=incoming_data.get('allowed_events'),
+                        keybind_presets=incoming_data.get('keybind_presets') or {},
+                    )
+
+                elif incoming_data.get('type') == 'keybind_preset_library':
+                    try:
+                        output_client.set_keybind_preset_library(incoming_data.get('presets') or {})
+                    except (AttributeError, TypeError, ValueError) as error:
+                        print(f'[WARNING] Invalid keybind preset library from {output_client.id}: {error}')
+
+                elif incoming_data.get('type') == 'update_device':
+                    device = output_client.devices.get(incoming_data.get('device_id'))
+                    if not device:
+                        continue
+
+                    group = ConnectionManager.get().get_group(device.group_id)
+                    group.post('update_device', output_client=output_client, output_device_id=device.id, data=incoming_data)
+
+                elif incoming_data.get('type') == 'unregister_device':
+                    device = output_client.devices.pop(incoming_data.get('device_id'), None)
+                    if not device:
+                        continue
+
+                    group = ConnectionManager.get().get_group(device.group_id)
+                    group.post('remove_devices', output_device_ids=[device.id])
+
+                elif incoming_data.get('type') == 'latency_report':
+                    reported_devices: dict[str, dict] = incoming_data.get('devices') or {}
+                    for device_id, stages in reported_devices.items():
+                        device = output_client.devices.get(device_id)
+                        if not device or not isinstance(stages, dict):
+                            continue
+                        try:
+                            device.merge_latency_report(stages)
+                        except (TypeError, ValueError) as error:
+                            print(f'[WARNING] Invalid latency report for device {device_id}: {error}')
+
+                elif incoming_data.get('type') == 'pong':
+                    await ConnectionManager.get().handle_pong(output_client.id, incoming_data)
 
         except fastapi.WebSocketDisconnect:
-            await output_client.remove_all_devices()
+            output_client.remove_all_devices()
             ConnectionManager.get().output_clients.pop(output_client.id)
+            ConnectionManager.get().record(output_client.id, 'close')
             break
 
 
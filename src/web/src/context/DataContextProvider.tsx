@@ -9,7 +9,12 @@ import {
 import { DataContext } from "./DataContext";
 import { Status, type User } from "../types";
 import { useConnectionManager } from "../hooks/useConnectionManager";
-import { useLocalStorageUserData } from "../hooks/useLocalStorage";
+import {
+  loadTraceLatency,
+  useLocalStorageUserData,
+} from "../hooks/useLocalStorage";
+
+const traceLatency = loadTraceLatency();
 
 interface DataContextProviderProps {
   children: ReactNode;
@@ -245,6 +250,7 @@ export default function DataContextProvider({
           device_id: deviceId,
           code: buttonCode,
           state: state,
+          ...(traceLatency && { trace: { client_send: Date.now() / 1000 } }),
         });
       });
     },
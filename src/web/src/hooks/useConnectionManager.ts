@@ -1,8 +1,16 @@
-import { useCallback, useMemo, useReducer, useState } from "react";
+import {
+  useCallback,
+  useEffect,
+  useMemo,
+  useReducer,
+  useRef,
+  useState,
+} from "react";
 import {
   Status,
   type Device,
   type GroupState,
+  type GroupStateSnapshot,
   type GroupUpdateAction,
   type Keybind,
   type SlotPresets,
@@ -14,6 +22,7 @@ import useWebSocket from "react-use-websocket";
 
 const protocol = window.location.protocol === "https:" ? "wss" : "ws";
 const websocketUrl = `${protocol}://${window.location.host}/ws/user`;
+const activityUpdateInterval = 1; // seconds
 
 function groupStateReducer(state: GroupState, action: GroupUpdateAction) {
   switch (action.type) {
@@ -22,24 +31,25 @@ function groupStateReducer(state: GroupState, action: GroupUpdateAction) {
     case "set_users_and_devices":
       return { users: action.users, devices: action.devices };
     case "activity_and_ping":
-      state.users.forEach((user, index) => {
-        if (action.users && user.id in action.users) {
-          const updatedLastActivity = action.users?.[user.id][0];
-          const updatedPing = action.users?.[user.id][1];
-
-          state.users[index].lastActivityTime =
-            updatedLastActivity || user.lastActivityTime;
-          state.users[index].lastPing = updatedPing || null;
-        }
-      });
-      state.devices.forEach((device, index) => {
-        if (action.devices && device.id in action.devices) {
-          const updatedPing = action.devices?.[device.id];
+      // the server only sends entries that changed since the last update
+      return {
+        users: state.users.map((user) => {
+          if (!action.users || !(user.id in action.users)) return user;
+          const [updatedLastActivity, updatedPing] = action.users[user.id];
 
-          state.devices[index].lastPing = updatedPing || null;
-        }
-      });
-      return state;
+          return {
+            ...user,
+            lastActivityTime: updatedLastActivity || user.lastActivityTime,
+            lastPing: updatedPing || null,
+          };
+        }),
+        devices: state.devices.map((device) => {
+          if (!action.devices || !(device.id in action.devices)) return device;
+          const [updatedPing] = action.devices[device.id];
+
+          return { ...device, lastPing: updatedPing || null };
+        }),
+      };
     default:
       return state;
   }
@@ -64,6 +74,16 @@ export function useConnectionManager({
     onOpen: () => {
       setConnectionStatus(Status.Connected);
 
+      // the server sends each keybind preset only once per connection
+      keybindPresetsById.current = {};
+
+      // activity and ping values are only sent to subscribed users
+      sendMessage({
+        type: "subscribe_activity",
+        interval: activityUpdateInterval,
+      });
+      sendMessage({ type: "visibility", hidden: document.hidden });
+
       if (lastGroupId) handleJoinGroup(lastGroupId);
     },
     onClose: (_) => {
@@ -82,6 +102,8 @@ export function useConnectionManager({
     users: [],
     devices: [],
   });
+  const keybindPresetsById = useRef<Record<string, Keybind[]>>({});
+  const hasReceivedGroupState = useRef(false);
 
   const user = useMemo(() => {
     if (!userId) return null;
@@ -107,6 +129,17 @@ export function useConnectionManager({
     [sendJsonMessage]
   );
 
+  useEffect(() => {
+    // hidden tabs receive activity and ping updates less often
+    const handleVisibilityChange = () => {
+      sendMessage({ type: "visibility", hidden: document.hidden });
+    };
+
+    document.addEventListener("visibilitychange", handleVisibilityChange);
+    return () =>
+      document.removeEventListener("visibilitychange", handleVisibilityChange);
+  }, [sendMessage]);
+
   const handleActivityAndPingUpdateMessage = useCallback(
     (
       data: Extract<WebSocketIncomingMessage, { type: "activity_and_ping" }>
@@ -152,14 +185,9 @@ export function useConnectionManager({
 
           const keybindPresets: Record<string, Keybind[]> = Object.fromEntries(
             Object.entries(device.keybind_presets).map(
-              ([presetName, keybinds]) => [
+              ([presetName, presetId]) => [
                 presetName,
-                keybinds.map(
-                  ([key, event]: WebSocketMessageKeybind): Keybind => ({
-                    key: key || null,
-                    event: event || null,
-                  })
-                ),
+                keybindPresetsById.current[presetId] || [],
               ]
             )
           );
@@ -213,9 +241,27 @@ export function useConnectionManager({
     [setGroupId, setSlotPresets]
   );
 
+  const handleKeybindPresetsMessage = useCallback(
+    (data: Extract<WebSocketIncomingMessage, { type: "keybind_presets" }>) => {
+      Object.entries(data.presets).forEach(([presetId, keybinds]) => {
+        keybindPresetsById.current[presetId] = keybinds.map(
+          ([key, event]: WebSocketMessageKeybind): Keybind => ({
+            key: key || null,
+            event: event || null,
+          })
+        );
+      });
+    },
+    []
+  );
+
   const handlePingRequestMessage = useCallback(
     (data: Extract<WebSocketIncomingMessage, { type: "ping" }>) => {
-      sendMessage({ type: "pong", id: data.id });
+      sendMessage({
+        type: "pong",
+        id: data.id,
+        client_time: Date.now() / 1000,
+      });
     },
     [sendMessage]
   );
@@ -231,8 +277,12 @@ export function useConnectionManager({
           handleConfigMessage(data);
           break;
         case "group_state":
+          hasReceivedGroupState.current = true;
           handleGroupStateMessage(data);
           break;
+        case "keybind_presets":
+          handleKeybindPresetsMessage(data);
+          break;
         case "ping":
           handlePingRequestMessage(data);
           break;
@@ -245,10 +295,31 @@ export function useConnectionManager({
       handleActivityAndPingUpdateMessage,
       handleConfigMessage,
       handleGroupStateMessage,
+      handleKeybindPresetsMessage,
       handlePingRequestMessage,
     ]
   );
 
+  useEffect(() => {
+    // show the last group from its cached snapshot until the websocket joined it
+    if (!lastGroupId) return;
+
+    fetch(`/groups/${encodeURIComponent(lastGroupId)}/state`)
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data: GroupStateSnapshot | null) => {
+        if (!data || hasReceivedGroupState.current) return;
+
+        handleKeybindPresetsMessage({
+          type: "keybind_presets",
+          presets: data.keybind_presets,
+        });
+        handleGroupStateMessage(data);
+      })
+      .catch((error) => console.warn("Failed to load group state:", error));
+    // only on the first render
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+
   const handleJoinGroup = useCallback(
     (groupId: string) => {
       sendMessage({
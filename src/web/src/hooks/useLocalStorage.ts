@@ -9,6 +9,7 @@ const STORAGE_CUSTOM_KEYBINDS_KEY = "dvc_custom_keybinds";
 const STORAGE_LAST_GROUP_ID_KEY = "dvc_last_group_id";
 const STORAGE_NAME_KEY = "dvc_name";
 const STORAGE_SLOT_PRESETS_KEY = "dvc_slot_presets";
+const STORAGE_TRACE_LATENCY_KEY = "dvc_trace_latency";
 
 export function saveUserPreferences(
   color: string,
@@ -53,6 +54,12 @@ export function loadCustomKeybinds() {
   return customKeybinds;
 }
 
+export function loadTraceLatency() {
+  // opt-in latency tracing, enable with
+  // localStorage.setItem("dvc_trace_latency", "true")
+  return localStorage.getItem(STORAGE_TRACE_LATENCY_KEY) === "true";
+}
+
 export function useLocalStorageUserData() {
   // create state variables and load data from local storage (or default values)
   const { storedName, storedColor, storedLastGroupId } = loadUserPreferences();
@@ -41,8 +41,8 @@ export type GroupUpdateAction =
   | { type: "set_users_and_devices"; users: User[]; devices: Device[] }
   | {
       type: "activity_and_ping";
-      users?: Record<string, [number, number]>;
-      devices?: Record<string, number>;
+      users?: Record<string, [number, number | null]>;
+      devices?: Record<string, [number | null]>;
     };
 
 export const Status = {
@@ -61,25 +61,45 @@ export type WebSocketIncomingMessage =
     }
   | {
       type: "activity_and_ping";
-      users?: Record<string, [number, number]>;
-      devices?: Record<string, number>;
+      users?: Record<string, [number, number | null]>;
+      devices?: Record<string, [number | null]>;
+    }
+  | {
+      type: "keybind_presets";
+      presets: Record<string, WebSocketMessageKeybind[]>;
     }
   | { type: "ping"; id: string };
 
+export type GroupStateSnapshot = Extract<
+  WebSocketIncomingMessage,
+  { type: "group_state" }
+> & {
+  version: number;
+  keybind_presets: Record<string, WebSocketMessageKeybind[]>;
+};
+
 export type WebSocketOutgoingMessage =
-  | { type: "pong"; id: string }
+  | { type: "pong"; id: string; client_time: number }
   | { type: "join_group"; group_id: string }
+  | { type: "subscribe_activity"; interval: number | null }
+  | { type: "visibility"; hidden: boolean }
   | { type: "leave_group" }
   | { type: "rename_output"; id: string; name: string }
   | { type: "select_output"; id: string; state: boolean }
   | { type: "update_user_data"; name: string; color: string }
-  | { type: "keypress"; device_id: string; code: string; state: number };
+  | {
+      type: "keypress";
+      device_id: string;
+      code: string;
+      state: number;
+      trace?: { client_send: number };
+    };
 
 export interface WebSocketMessageDevice {
   id: string;
   name: string;
   slot: number;
-  keybind_presets: Record<string, WebSocketMessageKeybind[]>;
+  keybind_presets: Record<string, string>; // preset name -> preset id
   allowed_events: string[];
   last_ping: number | null;
   connected_user_ids: string[];